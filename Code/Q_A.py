@@ -2,11 +2,13 @@
 # This file defines a function qa_process that answers queries based on context retrieved from a vector store. 
 # It uses a language model to generate answers by applying a predefined prompt template that handles various types of input, including casual conversation and specific information requests. 
 # The function returns a comprehensive answer based on the provided context and query.
+# Retrieval goes through the shared query service, which batches concurrent queries from all sessions.
 #---------------------------------------------------------------------------------------------------------------
 
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.chains.question_answering import load_qa_chain
 from langchain.prompts import PromptTemplate
+from query_service import query_service
 
 def qa_process(vectorstore, query):
     """
@@ -21,7 +23,7 @@ def qa_process(vectorstore, query):
     """
     if query:
         # Retrieve relevant documents from the vector store based on the query
-        docs = vectorstore.similarity_search(query)
+        docs = query_service.similarity_search(vectorstore, query)
 
         # Define the prompt template for the language model
         prompt_template = """
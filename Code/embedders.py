@@ -0,0 +1,94 @@
+#----------------------------------------------------------------------------------
+# Selects the embedding backend used to index documents and embed queries.
+# Google Backend: Calls the Google Generative AI embedding model over the network.
+# Local Backend: Runs a sentence-transformers model on the CPU with batched, vectorized inference.
+# The backend is chosen with the EMBEDDING_BACKEND environment variable ("google" or "local").
+# Every backend exposes a model_id that is stored with each index, so an index built
+# with one model is never searched with vectors from another, and an embed_queries
+# method that embeds a batch of queries in one call.
+#----------------------------------------------------------------------------------
+import os
+from langchain_core.embeddings import Embeddings
+from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+GOOGLE_EMBEDDING_MODEL = "models/embedding-001"
+LOCAL_EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+class GoogleEmbedder(GoogleGenerativeAIEmbeddings):
+    """
+    Embeddings from the Google Generative AI embedding model.
+    """
+
+    @property
+    def model_id(self):
+        return "google:" + self.model
+
+    def embed_queries(self, texts):
+        """
+        Embed a batch of queries in one request.
+
+        Args:
+            texts (list): The queries to embed.
+
+        Returns:
+            list: One embedding per query.
+        """
+        return self.embed_documents(texts, task_type="retrieval_query")
+
+class LocalCPUEmbedder(Embeddings):
+    """
+    Embeddings from a sentence-transformers model running on the CPU.
+
+    Texts are encoded in batches into one normalized numpy matrix, so embedding
+    a query takes a few milliseconds instead of a network round trip.
+    """
+
+    def __init__(self, model_name=LOCAL_EMBEDDING_MODEL, batch_size=64):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise ImportError("The local embedding backend needs sentence-transformers. "
+                              "Install it with `pip install sentence-transformers`.")
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.model = SentenceTransformer(model_name, device="cpu")
+
+    @property
+    def model_id(self):
+        return "local:" + self.model_name
+
+    def encode(self, texts):
+        """
+        Encode a batch of texts into a matrix of normalized embeddings.
+
+        Args:
+            texts (list): The texts to encode.
+
+        Returns:
+            numpy.ndarray: One float32 row per text.
+        """
+        return self.model.encode(texts, batch_size=self.batch_size, convert_to_numpy=True,
+                                 normalize_embeddings=True, show_progress_bar=False)
+
+    def embed_documents(self, texts):
+        return self.encode(list(texts)).tolist()
+
+    def embed_query(self, text):
+        return self.encode([text])[0].tolist()
+
+    def embed_queries(self, texts):
+        return self.encode(list(texts))
+
+def get_embeddings():
+    """
+    Create the embedding backend selected by the EMBEDDING_BACKEND environment variable.
+
+    Returns:
+        Embeddings: The Google backend by default, or the local CPU backend when EMBEDDING_BACKEND is "local".
+    """
+    backend = os.getenv("EMBEDDING_BACKEND", "google").lower()
+    if backend == "google":
+        return GoogleEmbedder(model=os.getenv("GOOGLE_EMBEDDING_MODEL", GOOGLE_EMBEDDING_MODEL))
+    if backend == "local":
+        return LocalCPUEmbedder(model_name=os.getenv("LOCAL_EMBEDDING_MODEL", LOCAL_EMBEDDING_MODEL))
+    raise ValueError(f"Unknown embedding backend: {backend}. Use 'google' or 'local'.")
@@ -0,0 +1,83 @@
+#----------------------------------------------------------------------------------
+# Load test for the shared query service.
+# Simulates many students querying the same document at the same moment, first with one
+# similarity_search per query and then through the micro-batching query service, and
+# prints the throughput and latency of both. Every session gets its vector store from
+# create_embeddings, the same way the app does on upload.
+#
+# Usage (from the project root):
+#     python Code/load_test.py <path/to/file.pdf> [sessions] [queries_per_session]
+#----------------------------------------------------------------------------------
+import os
+import sys
+import time
+import threading
+
+QUERIES = [
+    "What is the main topic of this document?",
+    "Summarize the key points.",
+    "What are the definitions introduced?",
+    "Which examples are given?",
+    "What conclusions are drawn?",
+]
+
+def run_load(search, vectorstores, queries_per_session):
+    """
+    Run concurrent sessions that each issue a series of queries.
+
+    Args:
+        search (callable): Function taking a session's vector store and a query and returning documents.
+        vectorstores (list): The vector store of each concurrent session.
+        queries_per_session (int): Number of queries issued by each session.
+
+    Returns:
+        tuple: Total seconds taken and the sorted list of per-query latencies.
+    """
+    latencies = []
+    latencies_lock = threading.Lock()
+    start_barrier = threading.Barrier(len(vectorstores))
+
+    def session(session_id):
+        start_barrier.wait()
+        for i in range(queries_per_session):
+            query = QUERIES[(session_id + i) % len(QUERIES)]
+            started = time.perf_counter()
+            search(vectorstores[session_id], query)
+            with latencies_lock:
+                latencies.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=session, args=(i,)) for i in range(len(vectorstores))]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started, sorted(latencies)
+
+def report(name, total_time, latencies):
+    p50 = latencies[len(latencies) // 2] * 1000
+    p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000
+    print(f"{name:<12} {len(latencies) / total_time:10.1f} queries/s   p50 {p50:8.1f} ms   p95 {p95:8.1f} ms")
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python Code/load_test.py <path/to/file.pdf> [sessions] [queries_per_session]")
+        sys.exit(1)
+    # Imported here because utils creates the embedding backend on import
+    from utils import create_embeddings
+    from query_service import QueryService
+
+    pdf_path = sys.argv[1]
+    sessions = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+    queries_per_session = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+
+    # Each session uploads the PDF the way the app does and keeps the vector store it gets back
+    vectorstores = []
+    for _ in range(sessions):
+        with open(pdf_path, 'rb') as pdf_file_object:
+            vectorstores.append(create_embeddings(os.path.basename(pdf_path), pdf_file_object))
+    service = QueryService()
+
+    print(f"{sessions} concurrent sessions x {queries_per_session} queries on {os.path.basename(pdf_path)}")
+    report("unbatched", *run_load(lambda vs, q: vs.similarity_search(q), vectorstores, queries_per_session))
+    report("batched", *run_load(lambda vs, q: service.similarity_search(vs, q), vectorstores, queries_per_session))
@@ -3,17 +3,22 @@
 #
 # This script sets up a Streamlit web application that allows users to:
 # 1. Upload PDF documents and process them for further querying or quiz generation.
-# 2. Ask questions about the content of the uploaded PDFs.
+# 2. Ask questions about the content of the uploaded PDFs and summarize them.
 # 3. Take quizzes based on the content of the PDFs, with options for different quiz types.
 #-----------------------------------------------------
 
+import re
 import streamlit as st
 from langchain_google_genai import ChatGoogleGenerativeAI
-from utils import extract_text_from_pdf, text_split, create_embeddings
+from utils import create_embeddings
 from Q_A import qa_process
+from summarize import summarize_document, SUMMARY_LENGTHS
 from quiz1 import quiz_generation, process_quiz
 from quiz_display import true_false_display, mcq_processing
 
+# Chat messages asking for a summary of the whole document, e.g. "Summarize this PDF"
+WHOLE_DOCUMENT_SUMMARY = re.compile(r"(please )?summari[sz]e (this|the) (pdf|document|doc|file|book)[.!]?")
+
 # Title and Sidebar
 st.sidebar.title("About Us 💡")
 st.sidebar.write("""
@@ -84,15 +89,10 @@ def document_process(uploaded_file):
         vectorstore: The vectorstore created from the document chunks.
     """
     if uploaded_file is not None:
-        # Extract text from the PDF
-        document_text = extract_text_from_pdf(uploaded_file)
-        # Split the text into manageable chunks
-        chunks = text_split(document_text)
-
         st.write(f"Your {uploaded_file.name} is processing! Please wait some time")
 
-        # Create embeddings for the chunks
-        vectorstore = create_embeddings(chunks, uploaded_file.name, uploaded_file)
+        # Create or update the embeddings for the pages of the PDF
+        vectorstore = create_embeddings(uploaded_file.name, uploaded_file)
 
         st.write("➡️ Head over to the Q&A tab to start asking questions")
         return vectorstore
@@ -128,16 +128,31 @@ elif option == "Summarize & Ask Questions":
 
     # Ensure a document is uploaded and processed
     if st.session_state.uploaded_file and st.session_state.vectorstore:
+        summary_length = st.selectbox("Summary length:", list(SUMMARY_LENGTHS))
+        summarize = st.button("Summarize Document")
         query = st.chat_input("Please enter your query here.....")
 
+        if summarize and not query:
+            query = f"Summarize {st.session_state.uploaded_file.name} ({summary_length})"
+
         if query:
             # Add the user query to chat history
             st.session_state.chat_history.append({"role": "user", "content": query})
             with st.chat_message("user"):
                 st.markdown(query)
 
-            # Get the answer to the query
-            response = qa_process(st.session_state.vectorstore, query)
+            if summarize or WHOLE_DOCUMENT_SUMMARY.fullmatch(query.strip().lower()):
+                # Summarize the whole document with map-reduce over all chunks
+                with st.spinner("Summarizing your document..."):
+                    llm = ChatGoogleGenerativeAI(model="gemini-pro", temperature=0.3)
+                    response, skipped, total = summarize_document(llm, st.session_state.vectorstore,
+                                                                  st.session_state.uploaded_file.name, summary_length)
+                if skipped:
+                    response += (f"\n\n*Note: {skipped} of {total} parts of the document could not be summarized "
+                                 "and are not covered. Ask again to retry them.*")
+            else:
+                # Get the answer to the query
+                response = qa_process(st.session_state.vectorstore, query)
 
             # Add the assistant's response to chat history
             st.session_state.chat_history.append({"role": "assistant", "content": response})
@@ -0,0 +1,178 @@
+#----------------------------------------------------------------------------------
+# Shares one query service between all Streamlit sessions of the process.
+# Collects Concurrent Queries: Waits a few milliseconds after the first query so queries from other sessions can join the batch.
+# Embeds in One Call: Embeds every query of the batch with a single call to the embedding backend.
+# Searches in One Call per Index: Runs one batched FAISS search for all queries against the same index.
+# Indexes are shared between sessions by utils.load_vectorstore, so queries on the same document share one search.
+# Returns Results: Hands each session the documents for its own query.
+#----------------------------------------------------------------------------------
+import queue
+import threading
+import time
+import faiss
+import numpy as np
+from utils import vectorstore_lock
+
+class _QueryRequest:
+    """
+    A query waiting in the service, and the slot its result is returned in.
+    """
+
+    def __init__(self, vectorstore, query, k):
+        self.vectorstore = vectorstore
+        self.query = query
+        self.k = k
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class QueryService:
+    """
+    Micro-batches similarity searches coming from concurrent sessions.
+
+    Args:
+        max_wait (float): Seconds to wait for more queries after the first one arrives.
+        max_batch_size (int): Largest number of queries processed in one batch.
+        timeout (float): Seconds a caller waits for its result before giving up.
+    """
+
+    def __init__(self, max_wait=0.005, max_batch_size=64, timeout=60.0):
+        self.max_wait = max_wait
+        self.max_batch_size = max_batch_size
+        self.timeout = timeout
+        self._queue = queue.Queue()
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def similarity_search(self, vectorstore, query, k=4):
+        """
+        Return the documents most similar to the query, batched with concurrent queries.
+
+        Args:
+            vectorstore (FAISS): The vector store to search.
+            query (str): The query text.
+            k (int): Number of documents to return.
+
+        Returns:
+            list: The k most similar documents, most similar first.
+
+        Raises:
+            TimeoutError: If no result arrives within the service timeout.
+        """
+        self._start()
+        request = _QueryRequest(vectorstore, query, k)
+        self._queue.put(request)
+
+        # Check on the worker while waiting, and restart it if it has died
+        deadline = time.monotonic() + self.timeout
+        while not request.done.wait(timeout=min(1.0, self.timeout)):
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"No search result for {query!r} after {self.timeout} seconds.")
+            self._start()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _start(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="query-service", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            try:
+                self._process(batch)
+            except BaseException as e:
+                # Never leave a caller waiting on a batch that failed outside the per-group handling
+                for request in batch:
+                    if not request.done.is_set():
+                        request.error = e if isinstance(e, Exception) else RuntimeError(repr(e))
+                        request.done.set()
+                if not isinstance(e, Exception):
+                    raise
+
+    def _process(self, batch):
+        # One embedding call per embedding backend, normally a single one for the whole batch
+        by_embedder = {}
+        for request in batch:
+            by_embedder.setdefault(id(request.vectorstore.embedding_function), []).append(request)
+
+        for requests in by_embedder.values():
+            try:
+                vectors = embed_queries(requests[0].vectorstore.embedding_function, [r.query for r in requests])
+            except Exception as e:
+                for request in requests:
+                    request.error = e
+                    request.done.set()
+                continue
+
+            # One FAISS search per index; sessions on the same document hold the same shared object
+            by_index = {}
+            for request, vector in zip(requests, vectors):
+                by_index.setdefault(id(request.vectorstore), []).append((request, vector))
+
+            for pairs in by_index.values():
+                try:
+                    search_batch(pairs)
+                except Exception as e:
+                    for request, _ in pairs:
+                        request.error = e
+                finally:
+                    for request, _ in pairs:
+                        request.done.set()
+
+def embed_queries(embedder, queries):
+    """
+    Embed a batch of queries, in one call when the backend supports it.
+
+    Args:
+        embedder (Embeddings): The embedding backend.
+        queries (list): The queries to embed.
+
+    Returns:
+        numpy.ndarray: One float32 row per query.
+    """
+    if hasattr(embedder, "embed_queries"):
+        vectors = embedder.embed_queries(queries)
+    else:
+        vectors = [embedder.embed_query(query) for query in queries]
+    return np.asarray(vectors, dtype=np.float32)
+
+def search_batch(pairs):
+    """
+    Search one vector store for a batch of query vectors and store each request's documents.
+
+    Args:
+        pairs (list): (request, vector) tuples that all target the same vector store.
+    """
+    vectorstore = pairs[0][0].vectorstore
+    vectors = np.stack([vector for _, vector in pairs])
+    if getattr(vectorstore, "_normalize_L2", False):
+        faiss.normalize_L2(vectors)
+
+    k = max(request.k for request, _ in pairs)
+    results = []
+    # Hold the lock so a re-upload cannot change the index between the search and the lookups
+    with vectorstore_lock:
+        _, indices = vectorstore.index.search(vectors, k)
+        for row in indices:
+            results.append([vectorstore.docstore.search(vectorstore.index_to_docstore_id[i])
+                            for i in row if i != -1])
+
+    for (request, _), docs in zip(pairs, results):
+        request.result = docs[:request.k]
+
+# Shared by every session in the process
+query_service = QueryService()
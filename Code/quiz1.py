@@ -11,6 +11,7 @@
 
 from langchain.chains import LLMChain
 from langchain.prompts import PromptTemplate
+from query_service import query_service
 
 def generate_mcq(llm, context):
     mcq_prompt = """
@@ -58,7 +59,8 @@ def generate_qna(llm, context):
 
 def quiz_generation(llm, vector_store, user_choice):
     # Fetch context from vector store (assume the query is related to the quiz topic)
-    context = vector_store.similarity_search("Quiz topic", k=5)[0].page_content
+    # Go through the query service, which searches the shared vector store under its lock
+    context = query_service.similarity_search(vector_store, "Quiz topic", k=5)[0].page_content
     print("context:\n\n",context)
     
     # Generate quiz based on user choice and return both the question and answer
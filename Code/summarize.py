@@ -0,0 +1,257 @@
+#----------------------------------------------------------------------------------
+# Summarizes a whole document with map-reduce over all of its chunks.
+# Map Step: Summarizes every chunk concurrently and caches each summary by the hash of the chunk text, next to the index.
+# Finished summaries are saved as they arrive, and a failed chunk is retried and then skipped, so one failed call never loses the others.
+# Reduce Step: Combines the chunk summaries hierarchically, a group at a time, until one summary of the requested length is left.
+# Every call to the language model is retried, and the number of skipped chunks is returned so the student can be told.
+# Repeat summaries, or summaries at a different length, reuse the cached map step and only run the reduce step.
+#----------------------------------------------------------------------------------
+import os
+import json
+import hashlib
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from langchain.chains import LLMChain
+from langchain.prompts import PromptTemplate
+from utils import loaded_pages, vectorstore_lock
+
+SUMMARY_LENGTHS = {
+    "short": "in 3 to 5 sentences",
+    "medium": "in about three paragraphs",
+    "long": "in detail, in about one page, covering every main section",
+}
+
+# Number of summaries combined in one reduce call
+REDUCE_GROUP_SIZE = 10
+
+# Number of concurrent calls to the language model
+MAX_WORKERS = 8
+
+# Attempts per chunk summary before the chunk is skipped
+MAX_ATTEMPTS = 3
+
+# Number of new chunk summaries between writes of the cache file
+SAVE_EVERY = 10
+
+# One lock per summary cache file, so sessions summarizing the same document do not drop each other's summaries
+cache_locks = {}
+cache_locks_guard = threading.Lock()
+
+def cache_lock(cache_file):
+    """
+    Return the lock that serializes writes of one summary cache file.
+    """
+    with cache_locks_guard:
+        return cache_locks.setdefault(cache_file, threading.Lock())
+
+def load_summary_cache(cache_file):
+    """
+    Load cached chunk summaries from a JSON file.
+
+    Args:
+        cache_file (str): Path to the JSON file caching summaries by chunk hash.
+
+    Returns:
+        dict: The cached summary of each chunk hash.
+    """
+    if os.path.exists(cache_file):
+        try:
+            with open(cache_file, 'r') as f:
+                cache = json.load(f)
+            if isinstance(cache, dict):
+                return cache
+        except json.JSONDecodeError:
+            pass
+        print(f"The summary cache {cache_file} is unreadable. Starting a new one.")
+    return {}
+
+def save_summary_cache(summaries, cache_file):
+    """
+    Merge new chunk summaries into the JSON cache file.
+
+    The file is re-read under its lock, so summaries written by other sessions
+    are kept, and replaced in one rename, so readers never see a partial file.
+
+    Args:
+        summaries (dict): New summaries by chunk hash.
+        cache_file (str): Path to the JSON file caching summaries by chunk hash.
+    """
+    with cache_lock(cache_file):
+        cache = load_summary_cache(cache_file)
+        cache.update(summaries)
+
+        fd, temp_file = tempfile.mkstemp(dir=os.path.dirname(cache_file) or ".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(cache, f, indent=4)
+            os.replace(temp_file, cache_file)
+        except BaseException:
+            os.remove(temp_file)
+            raise
+
+def document_chunks(vectorstore):
+    """
+    Return the text of every chunk of a document, in page order.
+
+    The page order comes from the pages utils keeps in memory for the shared
+    vector store, so nothing is read from disk.
+
+    Args:
+        vectorstore (FAISS): The vector store of the document.
+
+    Returns:
+        list: The text of each chunk.
+    """
+    with vectorstore_lock:
+        pages = loaded_pages(vectorstore)
+        if pages is not None:
+            chunk_ids = [chunk_id for page in pages for chunk_id in page["ids"]]
+        else:
+            # Fall back to the order of the vectors in the index
+            chunk_ids = [vectorstore.index_to_docstore_id[i] for i in sorted(vectorstore.index_to_docstore_id)]
+
+        # Skip ids a concurrent re-upload has already removed from the docstore
+        docs = [vectorstore.docstore.search(chunk_id) for chunk_id in chunk_ids]
+        return [doc.page_content for doc in docs if hasattr(doc, "page_content")]
+
+def summarize_text(llm, template, text):
+    """
+    Run one summarization prompt over the given text.
+    """
+    prompt = PromptTemplate(input_variables=["text"], template=template)
+    llm_chain = LLMChain(llm=llm, prompt=prompt)
+    return llm_chain.run({"text": text})
+
+def summarize_with_retry(llm, template, text):
+    """
+    Run one summarization prompt, retrying with a growing delay when the call fails.
+    """
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            return summarize_text(llm, template, text)
+        except Exception as e:
+            if attempt == MAX_ATTEMPTS - 1:
+                raise
+            print(f"Summary call failed ({e}). Retrying.")
+            time.sleep(2 ** attempt)
+
+def map_chunks(llm, chunks, cache_file):
+    """
+    Summarize every chunk, reusing cached summaries and running the rest concurrently.
+
+    Summaries are written to the cache as they finish. Chunks that still fail
+    after retrying are left out, and summarized again on the next request.
+
+    Args:
+        llm (BaseLanguageModel): The language model used to summarize.
+        chunks (list): The text of each chunk.
+        cache_file (str): Path to the JSON file caching summaries by chunk hash.
+
+    Returns:
+        tuple: The summary of each chunk that could be summarized, in chunk order,
+        and the number of chunks that were skipped.
+    """
+    map_prompt = """
+    Summarize the following passage from a document in a few sentences.
+    Keep every definition, key fact and conclusion it contains.
+    Passage: {text}
+    Summary:
+    """
+    cache = load_summary_cache(cache_file)
+    chunk_hashes = [hashlib.sha256(chunk.encode()).hexdigest() for chunk in chunks]
+
+    missing = {}
+    for chunk_hash, chunk in zip(chunk_hashes, chunks):
+        if chunk_hash not in cache:
+            missing[chunk_hash] = chunk
+
+    if missing:
+        print(f"Summarizing {len(missing)} of {len(chunks)} chunks.")
+        failed = 0
+        new_summaries = {}
+        try:
+            with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+                futures = {executor.submit(summarize_with_retry, llm, map_prompt, chunk): chunk_hash
+                           for chunk_hash, chunk in missing.items()}
+                for done, future in enumerate(as_completed(futures), 1):
+                    try:
+                        new_summaries[futures[future]] = future.result()
+                    except Exception as e:
+                        failed += 1
+                        print(f"Skipping a chunk that could not be summarized: {e}")
+                    if done % SAVE_EVERY == 0:
+                        save_summary_cache(new_summaries, cache_file)
+        finally:
+            save_summary_cache(new_summaries, cache_file)
+            cache.update(new_summaries)
+
+        if failed:
+            print(f"{failed} of {len(missing)} chunks could not be summarized and were left out.")
+
+    summaries = [cache[chunk_hash] for chunk_hash in chunk_hashes if chunk_hash in cache]
+    return summaries, len(chunks) - len(summaries)
+
+def reduce_summaries(llm, summaries, length):
+    """
+    Combine summaries hierarchically into one summary of the requested length.
+
+    Args:
+        llm (BaseLanguageModel): The language model used to summarize.
+        summaries (list): The summaries to combine, in document order.
+        length (str): One of the keys of SUMMARY_LENGTHS.
+
+    Returns:
+        str: The summary of the whole document.
+    """
+    combine_prompt = """
+    The following are summaries of consecutive parts of a document.
+    Combine them into one summary, keeping the key facts and the order of the document.
+    Summaries: {text}
+    Combined summary:
+    """
+    final_prompt = """
+    The following are summaries of consecutive parts of a document.
+    Write a summary of the whole document """ + SUMMARY_LENGTHS[length] + """.
+    Summaries: {text}
+    Summary:
+    """
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        while len(summaries) > REDUCE_GROUP_SIZE:
+            groups = ["\n\n".join(summaries[i:i + REDUCE_GROUP_SIZE])
+                      for i in range(0, len(summaries), REDUCE_GROUP_SIZE)]
+            summaries = list(executor.map(lambda group: summarize_with_retry(llm, combine_prompt, group), groups))
+
+    return summarize_with_retry(llm, final_prompt, "\n\n".join(summaries))
+
+def summarize_document(llm, vectorstore, file_name, length="medium"):
+    """
+    Summarize a whole document with map-reduce over all of its chunks.
+
+    Args:
+        llm (BaseLanguageModel): The language model used to summarize.
+        vectorstore (FAISS): The vector store of the document.
+        file_name (str): Name of the PDF file.
+        length (str): One of the keys of SUMMARY_LENGTHS.
+
+    Returns:
+        tuple: The summary of the document, the number of chunks left out of it
+        because they could not be summarized, and the total number of chunks.
+    """
+    chunks = document_chunks(vectorstore)
+    if not chunks:
+        return "The document does not contain any text to summarize.", 0, 0
+
+    cache_file = "pickle_index/" + str(file_name[:-4]) + ".summaries.json"
+    summaries, skipped = map_chunks(llm, chunks, cache_file)
+    if not summaries:
+        return "The document could not be summarized right now. Please try again.", skipped, len(chunks)
+
+    try:
+        summary = reduce_summaries(llm, summaries, length)
+    except Exception as e:
+        # The chunk summaries are cached, so trying again only repeats the reduce step
+        print(f"Combining the summaries failed: {e}")
+        return "The document could not be summarized right now. Please try again.", skipped, len(chunks)
+    return summary, skipped, len(chunks)
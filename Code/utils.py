@@ -1,22 +1,26 @@
 # ---------------------------------------------------------------------------------
-# Extracts Text from PDFs: Reads and extracts text from PDF files.
+# Extracts Text from PDFs: Reads and extracts the text of every page of a PDF file.
 # Splits Text into Chunks: Divides extracted text into manageable chunks for further processing.
 # Checks for Duplicate Files: Computes and checks file hashes to identify if a PDF has been previously processed.
 # Creates or Loads Embeddings: Creates embeddings from text chunks if the file is new, or loads existing embeddings if the file is a duplicate.
-# Manages Pickle and Index Files: Saves or loads processed embeddings and index files to/from disk.
+# Updates Embeddings Incrementally: Hashes every page and, when a file with the same name changes, re-embeds only the added or changed pages.
+# Manages Pickle and Index Files: Saves or loads processed embeddings and index files to/from disk, rejecting indexes built with a different embedding model.
+# Shares Loaded Indexes: Keeps one vector store per index file in the process, so every session searching the same document uses the same object.
 # Handles File Processing: Processes PDFs, including updating metadata and avoiding reprocessing of duplicates.
 #----------------------------------------------------------------------------------
 import os
+import uuid
+import threading
 import faiss
 import hashlib
 import pickle
 import json
 from PyPDF2 import PdfReader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from langchain_community.vectorstores import FAISS
 import google.generativeai as genai
 import streamlit as st
+from embedders import get_embeddings, GOOGLE_EMBEDDING_MODEL
 from dotenv import load_dotenv
 
 # Load environment variables from a .env file
@@ -25,24 +29,35 @@ api_key = os.getenv("GOOGLE_API_KEY")
 genai.configure(api_key=api_key)
 print(api_key)  # For debugging purposes
 
-# Initialize embeddings model
-embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
+# Initialize the embedding backend selected by EMBEDDING_BACKEND
+embeddings = get_embeddings()
 
-def extract_text_from_pdf(pdf_file_object):
+# Vector stores loaded in this process, keyed by (pickle path, index path, embedding model)
+loaded_vectorstores = {}
+
+# Held while a shared vector store is searched or changed in place
+vectorstore_lock = threading.RLock()
+
+# One lock per pickle file, so an upload only waits for other uploads of the same file
+file_locks = {}
+file_locks_guard = threading.Lock()
+
+# Serializes reading and rewriting file_hashes.json
+file_hashes_lock = threading.Lock()
+
+def file_lock(pickle_file_path):
     """
-    Extract text from a PDF file object.
+    Return the lock that serializes creating and updating the index of one file.
 
     Args:
-        pdf_file_object (file-like object): The PDF file from which to extract text.
+        pickle_file_path (str): Path to the pickle file of the index.
 
     Returns:
-        str: The extracted text from the PDF.
+        threading.RLock: The lock of that file. It is reentrant because a stale
+        file_hashes.json entry can point an upload back at its own file.
     """
-    pdf = PdfReader(pdf_file_object)
-    text = ''
-    for page in pdf.pages:
-        text += page.extract_text()
-    return text
+    with file_locks_guard:
+        return file_locks.setdefault(pickle_file_path, threading.RLock())
 
 def text_split(document_text):
     """
@@ -85,14 +100,230 @@ def load_hash_files(json_file):
         existing_file_hashes = []
     return existing_file_hashes
 
-def create_embeddings(chunks, file_name, pdf_file_object):
+def extract_pages_from_pdf(pdf):
+    """
+    Extract the text of every page of a PDF.
+
+    Args:
+        pdf (PdfReader): The PDF file from which to extract text.
+
+    Returns:
+        list: The extracted text of each page, in page order.
+    """
+    return [page.extract_text() or '' for page in pdf.pages]
+
+def calculate_page_hashes(page_texts):
+    """
+    Calculate the SHA-256 hash of each page's text.
+
+    Args:
+        page_texts (list): The text of each page.
+
+    Returns:
+        list: The SHA-256 hash of each page, in page order.
+    """
+    return [hashlib.sha256(text.encode()).hexdigest() for text in page_texts]
+
+def save_vectorstore(vectorstore, pages, pickle_file_path, index_file_path):
+    """
+    Save the FAISS index and its metadata to disk.
+
+    The metadata pickle holds the docstore, the mapping from FAISS positions to
+    docstore ids, the embedding model and, for every page, its content hash and
+    the ids of its chunks.
+
+    The caller holds the file's lock, so the store is not changed while it is
+    written, and searches only read it. The files are written next to their
+    targets and renamed into place, so readers never see a partial file. Only
+    the swap of the shared entry takes vectorstore_lock.
+
+    Args:
+        vectorstore (FAISS): The vector store to save.
+        pages (list): One dictionary per page with its "hash" and chunk "ids".
+        pickle_file_path (str): Path to the pickle file.
+        index_file_path (str): Path to the index file.
+    """
+    faiss.write_index(vectorstore.index, index_file_path + ".tmp")
+
+    metadata = {
+        "docstore": vectorstore.docstore,
+        "index_to_docstore_id": vectorstore.index_to_docstore_id,
+        "pages": pages,
+        "embedding_model": embeddings.model_id,
+    }
+    with open(pickle_file_path + ".tmp", 'wb') as f:
+        pickle.dump(metadata, f)
+
+    os.replace(index_file_path + ".tmp", index_file_path)
+    os.replace(pickle_file_path + ".tmp", pickle_file_path)
+
+    with vectorstore_lock:
+        loaded_vectorstores[(pickle_file_path, index_file_path, embeddings.model_id)] = (vectorstore, pages)
+
+def load_vectorstore(pickle_file_path, index_file_path):
+    """
+    Load a FAISS index and its metadata from disk.
+
+    An index already loaded in this process is returned as is, so all sessions
+    share one vector store per index file.
+
+    Args:
+        pickle_file_path (str): Path to the pickle file.
+        index_file_path (str): Path to the index file.
+
+    Returns:
+        tuple: The vector store and its list of pages. The list of pages is None
+        for indexes saved before page hashes were recorded.
+
+    Raises:
+        ValueError: If the index was built with a different embedding model than the current one.
+    """
+    key = (pickle_file_path, index_file_path, embeddings.model_id)
+    with vectorstore_lock:
+        if key in loaded_vectorstores:
+            return loaded_vectorstores[key]
+
+    with open(pickle_file_path, 'rb') as f:
+        metadata = pickle.load(f)
+
+    # Indexes saved before the model was recorded were all built with the Google model
+    embedding_model = "google:" + GOOGLE_EMBEDDING_MODEL
+    if isinstance(metadata, dict):
+        embedding_model = metadata.get("embedding_model", embedding_model)
+    if embedding_model != embeddings.model_id:
+        raise ValueError(f"Index {index_file_path} was built with {embedding_model}, "
+                         f"but the current embedding model is {embeddings.model_id}.")
+
+    index = faiss.read_index(index_file_path)
+
+    if isinstance(metadata, dict):
+        vectorstore = FAISS(embedding_function=embeddings, index=index, docstore=metadata["docstore"],
+                            index_to_docstore_id=metadata["index_to_docstore_id"])
+        pages = metadata["pages"]
+    else:
+        # Older indexes only pickled the docstore, without page hashes
+        vectorstore = FAISS(embedding_function=embeddings, index=index, docstore=metadata, index_to_docstore_id={})
+        pages = None
+
+    with vectorstore_lock:
+        # Another session may have loaded the same index in the meantime
+        return loaded_vectorstores.setdefault(key, (vectorstore, pages))
+
+def loaded_pages(vectorstore):
+    """
+    Return the pages recorded for a vector store loaded or saved in this process.
+
+    Args:
+        vectorstore (FAISS): A vector store returned by load_vectorstore or create_embeddings.
+
+    Returns:
+        list: One dictionary per page with its "hash" and chunk "ids", or None if
+        the store is not shared or has no page hashes.
+    """
+    with vectorstore_lock:
+        for shared_vectorstore, pages in loaded_vectorstores.values():
+            if shared_vectorstore is vectorstore:
+                return pages
+    return None
+
+def split_pages(page_texts):
     """
-    Create or load embeddings for the provided chunks of text.
+    Split each page into chunks and assign every chunk a unique id.
+
+    Args:
+        page_texts (list): The text of each page to split.
+
+    Returns:
+        tuple: The list of chunk texts, the list of chunk ids, and for every page the list of its chunk ids.
+    """
+    texts = []
+    ids = []
+    page_ids = []
+    for page_text in page_texts:
+        chunks = text_split(page_text)
+        chunk_ids = [str(uuid.uuid4()) for _ in chunks]
+        texts.extend(chunks)
+        ids.extend(chunk_ids)
+        page_ids.append(chunk_ids)
+    return texts, ids, page_ids
+
+def build_vectorstore(page_texts, page_hashes):
+    """
+    Embed every page of a document into a new vector store.
+
+    Args:
+        page_texts (list): The text of each page.
+        page_hashes (list): The hash of each page.
+
+    Returns:
+        tuple: The vector store and its list of pages.
+    """
+    texts, ids, page_ids = split_pages(page_texts)
+    vectorstore = FAISS.from_texts(texts, embedding=embeddings, ids=ids)
+    pages = [{"hash": page_hash, "ids": chunk_ids} for page_hash, chunk_ids in zip(page_hashes, page_ids)]
+    return vectorstore, pages
+
+def update_vectorstore(vectorstore, stored_pages, page_texts, page_hashes):
+    """
+    Bring an existing vector store up to date with a revised document.
+
+    Pages whose hash is already stored keep their vectors. Only added or changed
+    pages are embedded, and the chunks of removed or changed pages are deleted,
+    so the work done is proportional to the size of the edit. The new pages are
+    embedded before the lock is taken, so searches only wait for the index change.
+
+    Args:
+        vectorstore (FAISS): The vector store built from the previous version of the document.
+        stored_pages (list): The pages recorded with the previous version.
+        page_texts (list): The text of each page of the revised document.
+        page_hashes (list): The hash of each page of the revised document.
+
+    Returns:
+        tuple: The list of pages of the revised document and the number of pages that were re-embedded.
+    """
+    # Pool the stored chunk ids by page hash; a hash may appear on several pages
+    stored_ids = {}
+    for page in stored_pages:
+        stored_ids.setdefault(page["hash"], []).append(page["ids"])
+
+    pages = []
+    changed_texts = []
+    changed_positions = []
+    for position, (page_text, page_hash) in enumerate(zip(page_texts, page_hashes)):
+        if stored_ids.get(page_hash):
+            pages.append({"hash": page_hash, "ids": stored_ids[page_hash].pop()})
+        else:
+            pages.append(None)
+            changed_texts.append(page_text)
+            changed_positions.append(position)
+
+    # Whatever is left in the pool belongs to pages that were removed or changed
+    removed_ids = [chunk_id for id_lists in stored_ids.values() for chunk_ids in id_lists for chunk_id in chunk_ids]
+
+    texts, ids, page_ids = split_pages(changed_texts)
+    vectors = embeddings.embed_documents(texts) if texts else []
+
+    with vectorstore_lock:
+        if removed_ids:
+            vectorstore.delete(removed_ids)
+        if texts:
+            vectorstore.add_embeddings(list(zip(texts, vectors)), ids=ids)
+    for position, chunk_ids in zip(changed_positions, page_ids):
+        pages[position] = {"hash": page_hashes[position], "ids": chunk_ids}
+
+    return pages, len(changed_positions)
+
+def create_embeddings(file_name, pdf_file_object):
+    """
+    Create, update or load embeddings for the provided PDF file.
+
+    If an index with the same name already exists, the pages of the file are
+    compared with the stored page hashes and only added or changed pages are
+    re-embedded. An index built with a different embedding model is rebuilt.
 
     Args:
-        chunks (list): List of text chunks to embed.
         file_name (str): Name of the PDF file.
-        pdf_file_object (file-like object): The PDF file used to check for duplicates.
+        pdf_file_object (file-like object): The PDF file to embed.
 
     Returns:
         FAISS: The vector store containing the embeddings.
@@ -102,78 +333,105 @@ def create_embeddings(chunks, file_name, pdf_file_object):
     
     pdf = PdfReader(pdf_file_object)
     pkl_file_name = str(file_name[:-4]) + ".pkl"
+    page_texts = extract_pages_from_pdf(pdf)
+    page_hashes = calculate_page_hashes(page_texts)
+
+    # Uploads of the same file, e.g. a whole class at once, are processed one at a time
+    with file_lock(pickle_file_path):
+        if not os.path.exists(pickle_file_path):
+            return upload_and_process_file(page_texts, page_hashes, pkl_file_name, pickle_file_path, index_file_path)
+
+        try:
+            vectorstore, stored_pages = load_vectorstore(pickle_file_path, index_file_path)
+        except (ValueError, OSError) as e:
+            print(e)
+            vectorstore, stored_pages = None, None
+
+        if stored_pages is None:
+            print("Index cannot be updated in place. Re-embedding the whole file.")
+            vectorstore, pages = build_vectorstore(page_texts, page_hashes)
+            save_vectorstore(vectorstore, pages, pickle_file_path, index_file_path)
+        elif [page["hash"] for page in stored_pages] == page_hashes:
+            print("File already exists! Processing skipped.")
+        else:
+            pages, changed_pages = update_vectorstore(vectorstore, stored_pages, page_texts, page_hashes)
+            save_vectorstore(vectorstore, pages, pickle_file_path, index_file_path)
+            print(f"File has changed! Re-embedded {changed_pages} of {len(pages)} pages.")
+        update_file_hash(pkl_file_name, calculate_file_hash(page_texts))
 
-    if os.path.exists(pickle_file_path):
-        print("File already exists! Processing skipped.")
-        index = faiss.read_index(index_file_path)
-        
-        with open(pickle_file_path, 'rb') as f:
-            metadata = pickle.load(f)
-        vectorstore = FAISS(embedding_function=embeddings, index=index, docstore=metadata, index_to_docstore_id={})
-    else:
-        vectorstore = upload_and_process_file(pdf, chunks, pkl_file_name, pickle_file_path, index_file_path)
-    
     return vectorstore
 
-def check_for_duplicates(existing_file_hashes, pdf, json_file, pkl_file_name):
+def check_for_duplicates(existing_file_hashes, file_hash):
     """
     Check if a file is a duplicate based on its hash.
 
+    Hashes are only recorded once a file's index has been saved, so a match
+    always points at files that were completely written.
+
     Args:
         existing_file_hashes (list): List of existing file hashes.
-        pdf (PdfReader): The PDF file to check.
-        json_file (str): The path to the JSON file containing file hashes.
-        pkl_file_name (str): The name of the pickle file.
+        file_hash (str): The SHA-256 hash of the PDF content.
 
     Returns:
         tuple or bool: A tuple with paths to existing files if a duplicate is found; otherwise, False.
     """
-    file_hash = calculate_file_hash(pdf)
-
     for existing_file in existing_file_hashes:
         if existing_file['hash'] == file_hash:
             return "pickle/" + existing_file['filename'], existing_file['index_file_path']
-    
-    # Update the dictionary with the new filename and hash
-    index_file_path = "pickle_index/" + str(pkl_file_name[:-4]) + ".index"
-    file_details = {
-        "filename": pkl_file_name,
-        "hash": file_hash,
-        "index_file_path": index_file_path
-    }
-    print("file_details:", file_details)
-
-    # Append the new dictionary to the list
-    existing_file_hashes.append(file_details)
-
-    # Save the updated dictionary back to the JSON file
-    with open(json_file, 'w') as f:
-        json.dump(existing_file_hashes, f, indent=4)
     return False
 
-def calculate_file_hash(pdf):
+def update_file_hash(pkl_file_name, file_hash):
+    """
+    Record the current hash of a file whose index has just been saved.
+
+    Args:
+        pkl_file_name (str): The name of the pickle file.
+        file_hash (str): The SHA-256 hash of the PDF content.
+    """
+    json_file = os.path.join(os.getcwd(), 'pickle', "file_hashes.json")
+    with file_hashes_lock:
+        existing_file_hashes = load_hash_files(json_file)
+
+        for existing_file in existing_file_hashes:
+            if existing_file['filename'] == pkl_file_name:
+                if existing_file['hash'] == file_hash:
+                    return
+                existing_file['hash'] = file_hash
+                break
+        else:
+            file_details = {
+                "filename": pkl_file_name,
+                "hash": file_hash,
+                "index_file_path": "pickle_index/" + str(pkl_file_name[:-4]) + ".index"
+            }
+            print("file_details:", file_details)
+            existing_file_hashes.append(file_details)
+
+        with open(json_file, 'w') as f:
+            json.dump(existing_file_hashes, f, indent=4)
+
+def calculate_file_hash(page_texts):
     """
     Calculate the SHA-256 hash of the PDF content.
 
     Args:
-        pdf (PdfReader): The PDF file to hash.
+        page_texts (list): The text of each page of the PDF.
 
     Returns:
         str: The SHA-256 hash of the PDF content.
     """
-    pdf_content = b""
-    for page in pdf.pages:
-        pdf_content += page.extract_text().encode()
-    file_hash = hashlib.sha256(pdf_content).hexdigest()
-    return file_hash
+    return hashlib.sha256("".join(page_texts).encode()).hexdigest()
 
-def upload_and_process_file(pdf, chunks, pkl_file_name, pickle_file_path, index_file_path):
+def upload_and_process_file(page_texts, page_hashes, pkl_file_name, pickle_file_path, index_file_path):
     """
     Upload and process the PDF file to create embeddings if not already processed.
 
+    Called with the file's lock held. The file hash is recorded only after the
+    index has been saved.
+
     Args:
-        pdf (PdfReader): The PDF file to process.
-        chunks (list): List of text chunks from the PDF.
+        page_texts (list): The text of each page of the PDF.
+        page_hashes (list): The hash of each page of the PDF.
         pkl_file_name (str): Name of the pickle file.
         pickle_file_path (str): Path to the pickle file.
         index_file_path (str): Path to the index file.
@@ -185,27 +443,32 @@ def upload_and_process_file(pdf, chunks, pkl_file_name, pickle_file_path, index_
     print("directory_path:", directory_path)
 
     json_file = os.path.join(directory_path, "file_hashes.json")
-    existing_file_hashes = load_hash_files(json_file)
+    with file_hashes_lock:
+        existing_file_hashes = load_hash_files(json_file)
 
     print("existing_files in upload and process func:", existing_file_hashes)
 
-    is_duplicate = check_for_duplicates(existing_file_hashes, pdf, json_file, pkl_file_name)
+    file_hash = calculate_file_hash(page_texts)
+    is_duplicate = check_for_duplicates(existing_file_hashes, file_hash)
 
     if is_duplicate:
         is_duplicate = list(is_duplicate)
-        print("Duplicate file found! Processing skipped.")
-        pickle_file_path = is_duplicate[0]
-        index_file_path = is_duplicate[1]
-        index = faiss.read_index(index_file_path)
-        
-        with open(pickle_file_path, 'rb') as f:
-            metadata = pickle.load(f)
-        vectorstore = FAISS(embedding_function=embeddings, index=index, docstore=metadata, index_to_docstore_id={})
-    else:
-        vectorstore = FAISS.from_texts(chunks, embedding=embeddings)
-        faiss.write_index(vectorstore.index, index_file_path)
-
-        with open(pickle_file_path, 'wb') as f:
-            pickle.dump(vectorstore.docstore, f)
-        print("Embeddings were created for given chunks.")
+        try:
+            # Hold the other file's lock so it is not being rewritten while it is read
+            with file_lock(is_duplicate[0]):
+                vectorstore, pages = load_vectorstore(is_duplicate[0], is_duplicate[1])
+        except (ValueError, OSError) as e:
+            # A different embedding model, or index files that were removed from disk
+            print(e)
+            pages = None
+
+        if pages is not None:
+            print("Duplicate file found! Processing skipped.")
+            return vectorstore
+        print("Duplicate index cannot be used. Creating new embeddings.")
+
+    vectorstore, pages = build_vectorstore(page_texts, page_hashes)
+    save_vectorstore(vectorstore, pages, pickle_file_path, index_file_path)
+    update_file_hash(pkl_file_name, file_hash)
+    print("Embeddings were created for given chunks.")
     return vectorstore